@@ -1,88 +1,384 @@
+import asyncio
 import os
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple, Union
 from datetime import date
 
 import streamlit as st
-from openai import OpenAI
+import tiktoken
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
 
 
 # ----------------------------
 # OpenAI Client
 # ----------------------------
-def get_openai_client() -> OpenAI:
-    return OpenAI()
+@st.cache_resource(show_spinner=False)
+def get_openai_client() -> Optional["OpenAI"]:
+    # Returns None when OPENAI_API_KEY is missing, so both the env check and
+    # the client construction happen once per process rather than per rerun.
+    # Imported lazily so cold start skips the SDK import (httpx, pydantic
+    # models) until the model is actually used. Cached as a resource so the
+    # connection pool (keep-alive sockets, TLS session) survives Streamlit
+    # reruns; HTTP/2 multiplexes all turns over one long-lived connection.
+    if not os.environ.get("OPENAI_API_KEY"):
+        return None
+
+    import httpx
+    from openai import OpenAI
+
+    return OpenAI(
+        http_client=httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        )
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_async_openai_client() -> "AsyncOpenAI":
+    import httpx
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(
+        http_client=httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        )
+    )
 
 
 # ----------------------------
 # System Prompt
 # ----------------------------
+# Static few-shot exemplars appended to the system prompt. Kept fully static
+# (no dates, no user data) so the system block is byte-identical across turns
+# and long enough to clear OpenAI's automatic prompt-caching minimum.
+_SYSTEM_PROMPT_EXAMPLES_EN = (
+    "\n\nReference examples (static, for style and structure only):\n"
+    "Example 1 — Circular letter request:\n"
+    "User: Draft a circular letter announcing the end-of-semester exam schedule to parents.\n"
+    "Assistant: Provide a formal circular with: letterhead placeholder, letter number placeholder, "
+    "subject line, respectful opening, exam dates and logistics, expectations for parents "
+    "(attendance, health, study support), contact placeholder, closing, and signatory block. "
+    "Keep paragraphs short and list key dates as bullet points.\n"
+    "Example 2 — Teacher development plan:\n"
+    "User: Help me plan teacher training for next semester.\n"
+    "Assistant: Ask for or assume the focus areas, then lay out a table of: training topic, "
+    "target teachers, facilitator (internal/external), proposed month, estimated budget placeholder, "
+    "and success indicator. Recommend at most two trainings per semester per teacher to protect "
+    "teaching hours, and suggest a simple post-training evaluation form.\n"
+    "Example 3 — Handling a parent complaint:\n"
+    "User: A parent complains their child is being treated unfairly in grading.\n"
+    "Assistant: Recommend a calm, documented process: acknowledge receipt, gather facts from the "
+    "subject teacher and grade records, hold a mediated meeting, explain the grading rubric, and "
+    "agree on follow-up in writing. Never promise a grade change before verification; keep the "
+    "homeroom teacher informed.\n"
+    "Example 4 — Schedule conflict:\n"
+    "User: Two teachers are scheduled in the same room at the same hour.\n"
+    "Assistant: List conflict-resolution steps: verify the master schedule, check room capacity and "
+    "alternatives, prioritize the class with fixed lab/equipment needs, update the schedule in one "
+    "authoritative document, and announce the change to affected teachers and students the same day.\n"
+    "Example 5 — School work plan and budget:\n"
+    "User: Draft a semester work plan with a limited budget.\n"
+    "Assistant: Structure the plan as a table: objective, main activity, person in charge, timeline, "
+    "estimated cost placeholder, and success indicator. Rank activities by impact on student "
+    "learning, mark which ones can run with zero additional cost, and flag items that need committee "
+    "or foundation approval. Close with a one-paragraph executive summary the principal can reuse "
+    "in reports.\n"
+    "Example 6 — Student discipline case:\n"
+    "User: There was a bullying report between two students in grade 11.\n"
+    "Assistant: Outline a staged response: secure and reassure the reported victim, document the "
+    "report with date and witnesses, interview each student separately with the counselor present, "
+    "inform both sets of parents factually and without blame, apply the school's sanction ladder "
+    "consistently, and schedule a follow-up check after two weeks. Remind the principal to log "
+    "everything for the student-affairs record and to avoid publicizing names.\n"
+    "Example 7 — Accreditation preparation:\n"
+    "User: Our accreditation visit is in three months. Where do we start?\n"
+    "Assistant: Propose a backward timeline from the visit date: form a task team with one owner "
+    "per standard, audit existing evidence against each instrument item, fill gaps in teaching "
+    "documents and school records first, run one internal mock assessment, and fix the physical "
+    "environment last. Present the plan as a month-by-month checklist with owners and placeholders "
+    "for document names.\n"
+    "Example 8 — Communicating with the school committee:\n"
+    "User: I need to ask the committee to support a library renovation.\n"
+    "Assistant: Draft a short proposal memo: current condition with data placeholders, impact on "
+    "students, two or three costed options, the specific support requested, and a transparent "
+    "reporting commitment. Suggest presenting it in a committee meeting rather than sending it "
+    "cold, and preparing answers about maintenance costs in advance.\n"
+    "Glossary of common terms (static): RKS/RKAS — school work plan and budget; P5 — Pancasila "
+    "student profile strengthening project; PIC — person in charge; wali kelas — homeroom teacher; "
+    "komite sekolah — school committee; surat edaran — circular letter; sarpras — facilities and "
+    "infrastructure; PPDB — new student admission; supervisi akademik — academic supervision; "
+    "rapor pendidikan — national education report card."
+)
+
+_SYSTEM_PROMPT_EXAMPLES_ID = (
+    "\n\nContoh referensi (statis, hanya untuk gaya dan struktur):\n"
+    "Contoh 1 — Permintaan surat edaran:\n"
+    "Pengguna: Buat surat edaran pengumuman jadwal ujian akhir semester untuk orang tua.\n"
+    "Asisten: Susun surat edaran formal dengan: placeholder kop surat, placeholder nomor surat, "
+    "perihal, salam pembuka yang hormat, tanggal ujian dan logistik, harapan kepada orang tua "
+    "(kehadiran, kesehatan, pendampingan belajar), placeholder kontak, penutup, dan blok tanda "
+    "tangan. Jaga paragraf tetap singkat dan tampilkan tanggal penting sebagai poin-poin.\n"
+    "Contoh 2 — Rencana pengembangan guru:\n"
+    "Pengguna: Bantu saya merencanakan pelatihan guru semester depan.\n"
+    "Asisten: Tanyakan atau asumsikan area fokus, lalu sajikan tabel berisi: topik pelatihan, guru "
+    "sasaran, fasilitator (internal/eksternal), usulan bulan, placeholder perkiraan anggaran, dan "
+    "indikator keberhasilan. Sarankan maksimal dua pelatihan per semester per guru agar jam "
+    "mengajar tetap terjaga, dan usulkan formulir evaluasi pasca-pelatihan yang sederhana.\n"
+    "Contoh 3 — Menangani keluhan orang tua:\n"
+    "Pengguna: Orang tua mengeluh anaknya diperlakukan tidak adil dalam penilaian.\n"
+    "Asisten: Rekomendasikan proses yang tenang dan terdokumentasi: konfirmasi penerimaan keluhan, "
+    "kumpulkan fakta dari guru mapel dan rekap nilai, adakan pertemuan yang dimediasi, jelaskan "
+    "rubrik penilaian, dan sepakati tindak lanjut secara tertulis. Jangan menjanjikan perubahan "
+    "nilai sebelum verifikasi; libatkan wali kelas.\n"
+    "Contoh 4 — Bentrok jadwal:\n"
+    "Pengguna: Dua guru terjadwal di ruang yang sama pada jam yang sama.\n"
+    "Asisten: Uraikan langkah penyelesaian: verifikasi jadwal induk, cek kapasitas dan alternatif "
+    "ruang, prioritaskan kelas dengan kebutuhan lab/peralatan tetap, perbarui jadwal pada satu "
+    "dokumen resmi, dan umumkan perubahan kepada guru serta siswa terdampak pada hari yang sama.\n"
+    "Contoh 5 — Rencana kerja dan anggaran sekolah:\n"
+    "Pengguna: Susun rencana kerja satu semester dengan anggaran terbatas.\n"
+    "Asisten: Sajikan rencana dalam tabel: tujuan, kegiatan utama, penanggung jawab, timeline, "
+    "placeholder perkiraan biaya, dan indikator keberhasilan. Urutkan kegiatan berdasarkan dampak "
+    "pada pembelajaran siswa, tandai kegiatan yang bisa berjalan tanpa biaya tambahan, dan beri "
+    "catatan untuk butir yang memerlukan persetujuan komite atau yayasan. Tutup dengan ringkasan "
+    "eksekutif satu paragraf yang bisa dipakai ulang dalam laporan.\n"
+    "Contoh 6 — Kasus kedisiplinan siswa:\n"
+    "Pengguna: Ada laporan perundungan antara dua siswa kelas 11.\n"
+    "Asisten: Uraikan respons bertahap: amankan dan tenangkan siswa yang dilaporkan menjadi korban, "
+    "dokumentasikan laporan dengan tanggal dan saksi, wawancarai tiap siswa secara terpisah dengan "
+    "pendampingan guru BK, informasikan kedua orang tua secara faktual tanpa menyalahkan, terapkan "
+    "tahapan sanksi sekolah secara konsisten, dan jadwalkan pemantauan lanjutan setelah dua minggu. "
+    "Ingatkan agar semua dicatat dalam arsip kesiswaan dan nama siswa tidak dipublikasikan.\n"
+    "Contoh 7 — Persiapan akreditasi:\n"
+    "Pengguna: Visitasi akreditasi tiga bulan lagi. Mulai dari mana?\n"
+    "Asisten: Usulkan timeline mundur dari tanggal visitasi: bentuk tim kerja dengan satu "
+    "penanggung jawab per standar, audit bukti fisik terhadap tiap butir instrumen, lengkapi dulu "
+    "dokumen pembelajaran dan administrasi sekolah yang kurang, lakukan satu kali simulasi "
+    "penilaian internal, dan benahi lingkungan fisik paling akhir. Sajikan sebagai daftar periksa "
+    "per bulan dengan penanggung jawab dan placeholder nama dokumen.\n"
+    "Contoh 8 — Komunikasi dengan komite sekolah:\n"
+    "Pengguna: Saya perlu meminta dukungan komite untuk renovasi perpustakaan.\n"
+    "Asisten: Susun memo proposal singkat: kondisi saat ini dengan placeholder data, dampak bagi "
+    "siswa, dua atau tiga opsi beserta perkiraan biaya, bentuk dukungan spesifik yang diminta, dan "
+    "komitmen pelaporan yang transparan. Sarankan memaparkannya dalam rapat komite alih-alih "
+    "mengirim dokumen begitu saja, serta menyiapkan jawaban soal biaya perawatan sejak awal.\n"
+    "Glosarium istilah umum (statis): RKS/RKAS — rencana kerja dan anggaran sekolah; P5 — projek "
+    "penguatan profil pelajar Pancasila; PIC — penanggung jawab; wali kelas — guru penanggung "
+    "jawab kelas; komite sekolah — badan mitra orang tua dan sekolah; surat edaran — surat "
+    "pemberitahuan resmi; sarpras — sarana dan prasarana; PPDB — penerimaan peserta didik baru; "
+    "supervisi akademik — pembinaan proses pembelajaran; rapor pendidikan — laporan mutu "
+    "pendidikan nasional."
+)
+
+
+# Both prompt variants are assembled once at import time. They must stay
+# byte-identical for a given language: OpenAI's prefix cache only hits on an
+# identical leading token sequence, so never append dates, session data, or
+# other dynamic content here.
+_SYSTEM_PROMPTS = {
+    "en": (
+        "You are an AI advisor assisting a high school principal in Indonesia. "
+        "Goals: provide practical, concise, and actionable guidance on school management, curriculum planning, teacher development, "
+        "student affairs, school operations, parent/community communications, and event planning. "
+        "Constraints: do not fabricate facts or legal references; when unsure, say so and suggest how to verify. "
+        "Default response is concise with bullet points and step-by-step actions. "
+        "Provide templates (letters, schedules, memos) with placeholders and clear instructions. "
+        "If the user asks, you can switch to Indonesian or bilingual output. "
+        "Tone: respectful, professional, supportive, and solution-oriented."
+        + _SYSTEM_PROMPT_EXAMPLES_EN
+    ),
+    "id": (
+        "Anda adalah asisten AI yang membantu kepala sekolah menengah atas di Indonesia. "
+        "Tujuan: berikan panduan yang praktis, ringkas, dan dapat ditindaklanjuti terkait manajemen sekolah, perencanaan kurikulum, "
+        "pengembangan guru, kesiswaan, operasional, komunikasi orang tua/komite, dan perencanaan kegiatan. "
+        "Batasan: jangan mengada-ada fakta atau dasar hukum; jika ragu, sampaikan dengan jujur dan sarankan cara memverifikasi. "
+        "Default jawaban: ringkas, dengan poin-poin dan langkah-langkah. "
+        "Sediakan template (surat, jadwal, memo) dengan placeholder dan instruksi yang jelas. "
+        "Jika diminta, Anda dapat menggunakan bahasa Inggris atau keluaran dwibahasa. "
+        "Nada: hormat, profesional, suportif, dan berorientasi solusi."
+        + _SYSTEM_PROMPT_EXAMPLES_ID
+    ),
+}
+
+
 def build_system_prompt(language: str = "id") -> str:
-    if language == "en":
-        return (
-            "You are an AI advisor assisting a high school principal in Indonesia. "
-            "Goals: provide practical, concise, and actionable guidance on school management, curriculum planning, teacher development, "
-            "student affairs, school operations, parent/community communications, and event planning. "
-            "Constraints: do not fabricate facts or legal references; when unsure, say so and suggest how to verify. "
-            "Default response is concise with bullet points and step-by-step actions. "
-            "Provide templates (letters, schedules, memos) with placeholders and clear instructions. "
-            "If the user asks, you can switch to Indonesian or bilingual output. "
-            "Tone: respectful, professional, supportive, and solution-oriented."
-        )
-    else:
-        return (
-            "Anda adalah asisten AI yang membantu kepala sekolah menengah atas di Indonesia. "
-            "Tujuan: berikan panduan yang praktis, ringkas, dan dapat ditindaklanjuti terkait manajemen sekolah, perencanaan kurikulum, "
-            "pengembangan guru, kesiswaan, operasional, komunikasi orang tua/komite, dan perencanaan kegiatan. "
-            "Batasan: jangan mengada-ada fakta atau dasar hukum; jika ragu, sampaikan dengan jujur dan sarankan cara memverifikasi. "
-            "Default jawaban: ringkas, dengan poin-poin dan langkah-langkah. "
-            "Sediakan template (surat, jadwal, memo) dengan placeholder dan instruksi yang jelas. "
-            "Jika diminta, Anda dapat menggunakan bahasa Inggris atau keluaran dwibahasa. "
-            "Nada: hormat, profesional, suportif, dan berorientasi solusi."
-        )
+    return _SYSTEM_PROMPTS.get(language, _SYSTEM_PROMPTS["id"])
 
 
 # ----------------------------
 # Session State Helpers
 # ----------------------------
+_SESSION_DEFAULTS = {
+    "messages": [],
+    "language": "id",
+    "model": "gpt-4o-mini",
+    "temperature": 0.3,
+    "max_tokens": 800,
+    "pending_prompts": [],
+    "transcript_bytes": b"",
+}
+
+
 def init_session_state():
-    if "messages" not in st.session_state:
-        st.session_state.messages: List[Dict[str, str]] = []
-    if "language" not in st.session_state:
-        st.session_state.language = "id"
-    if "model" not in st.session_state:
-        st.session_state.model = "gpt-4"
-    if "temperature" not in st.session_state:
-        st.session_state.temperature = 0.3
-    if "max_tokens" not in st.session_state:
-        st.session_state.max_tokens = 800
-    if "pending_prompt" not in st.session_state:
-        st.session_state.pending_prompt = ""
+    for key, default in _SESSION_DEFAULTS.items():
+        if key not in st.session_state:
+            # Copy mutable defaults so sessions never share a list instance
+            st.session_state[key] = list(default) if isinstance(default, list) else default
+    # Derived entries that depend on the defaults above
+    if "system_prompt" not in st.session_state:
+        st.session_state.system_prompt = build_system_prompt(st.session_state.language)
+    if "wire_messages" not in st.session_state:
+        # History kept permanently in OpenAI wire format ([system] + turns),
+        # appended to in add_message, so each call passes it as-is instead of
+        # rebuilding and copying the whole list every turn.
+        st.session_state.wire_messages = [
+            {"role": "system", "content": st.session_state.system_prompt}
+        ]
 
 
 def add_message(role: str, content: str):
-    st.session_state.messages.append({"role": role, "content": content})
+    entry = {"role": role, "content": content}
+    st.session_state.messages.append(entry)
+    st.session_state.wire_messages.append(entry)
+    # Extend the pre-encoded download payload here, once per message, so
+    # render_chat never reformats or re-encodes the transcript on a rerun.
+    label = "USER" if role == "user" else "ASSISTANT"
+    separator = b"\n" if st.session_state.transcript_bytes else b""
+    st.session_state.transcript_bytes += separator + f"{label}:\n{content}\n".encode("utf-8")
 
 
 def clear_conversation():
     st.session_state.messages = []
+    del st.session_state.wire_messages[1:]  # keep the system message
+    st.session_state.transcript_bytes = b""
 
 
 # ----------------------------
 # OpenAI Chat Interaction
 # ----------------------------
+@st.cache_resource(show_spinner=False)
+def get_token_encoder(model: str) -> "tiktoken.Encoding":
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _summarize_history(model: str, dropped: List[Dict[str, str]]) -> str:
+    # One-off compression of turns that fell out of the token budget.
+    # Routed through _cached_completion (temperature 0) so the same dropped
+    # prefix is only ever summarized once.
+    transcript = build_transcript(tuple((m["role"], m["content"]) for m in dropped))
+    return _cached_completion(
+        model,
+        (
+            (
+                "system",
+                "Ringkas percakapan berikut menjadi catatan singkat (maksimal "
+                "10 poin) yang mempertahankan keputusan, fakta, dan konteks "
+                "penting untuk melanjutkan percakapan.",
+            ),
+            ("user", transcript),
+        ),
+        0.0,
+        300,
+    )
+
+
+def compact_history(
+    messages: List[Dict[str, str]],
+    model: str,
+    max_tokens: int = 4000,
+) -> List[Dict[str, str]]:
+    # Sliding window over the conversation: keep the newest turns verbatim
+    # until the token budget is spent, and compress everything older into a
+    # single summary note so input cost stops growing linearly with turns.
+    if len(messages) <= 2:
+        return messages
+
+    encoder = get_token_encoder(model)
+    budget = max_tokens
+    cut = len(messages) - 1  # index of the first verbatim-kept turn
+    for i in range(len(messages) - 1, 0, -1):
+        cost = len(encoder.encode(messages[i]["content"]))
+        if cost > budget and i < len(messages) - 1:
+            break
+        budget -= cost
+        cut = i
+    if cut <= 1:
+        return messages  # everything fits within the budget
+
+    summary = _summarize_history(model, messages[1:cut])
+    return [
+        messages[0],
+        {"role": "system", "content": f"Ringkasan percakapan sebelumnya:\n{summary}"},
+        *messages[cut:],
+    ]
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _cached_completion(
+    model: str,
+    messages: Tuple[Tuple[str, str], ...],
+    temperature: float,
+    max_tokens: int,
+) -> str:
+    # Exact-match response cache: identical (model, messages, sampling)
+    # combinations skip the network call for an hour. Messages arrive as a
+    # tuple of (role, content) pairs so st.cache_data can hash them.
+    response = get_openai_client().chat.completions.create(
+        model=model,
+        messages=[{"role": role, "content": content} for role, content in messages],
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    return response.choices[0].message.content
+
+
 def ask_openai(
-    client: OpenAI,
     model: str,
-    system_prompt: str,
-    history: List[Dict[str, str]],
-    user_input: str,
+    messages: List[Dict[str, str]],
     temperature: float = 0.3,
     max_tokens: int = 800,
-) -> str:
-    # Compose messages: system + history + latest user input
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(history)
-    messages.append({"role": "user", "content": user_input})
+    stream: bool = True,
+) -> Union[str, Iterator[str]]:
+    # `messages` is already in wire format ([system] + history + latest user
+    # input, see wire_messages in init_session_state) — no per-turn rebuild.
+    client = get_openai_client()
+    messages = compact_history(messages, model)
+
+    # Near-deterministic requests are safe to answer from the exact-match
+    # cache; higher temperatures are intentionally varied, so skip it.
+    if temperature < 0.15:
+        reply = _cached_completion(
+            model,
+            tuple((m["role"], m["content"]) for m in messages),
+            temperature,
+            max_tokens,
+        )
+        return iter((reply,)) if stream else reply
+
+    if stream:
+        # Yield tokens as they arrive so the UI can render them immediately
+        # instead of blocking until the full completion is generated.
+        def token_stream() -> Iterator[str]:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            for chunk in response:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
+
+        return token_stream()
 
     response = client.chat.completions.create(
         model=model,
@@ -93,9 +389,27 @@ def ask_openai(
     return response.choices[0].message.content
 
 
+async def ask_openai_async(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float = 0.3,
+    max_tokens: int = 800,
+) -> str:
+    # Non-streaming async variant used to fan out several queued template
+    # prompts with asyncio.gather instead of serializing them.
+    response = await get_async_openai_client().chat.completions.create(
+        model=model,
+        messages=compact_history(messages, model),
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    return response.choices[0].message.content
+
+
 # ----------------------------
 # UI Components
 # ----------------------------
+@st.fragment
 def sidebar_controls():
     st.sidebar.header("Pengaturan")
     lang = st.sidebar.selectbox(
@@ -105,13 +419,20 @@ def sidebar_controls():
         format_func=lambda x: x[1],
         key="language_selector",
     )
-    st.session_state.language = lang[0]
+    if lang[0] != st.session_state.language:
+        st.session_state.language = lang[0]
+        st.session_state.system_prompt = build_system_prompt(lang[0])
+        st.session_state.wire_messages[0] = {
+            "role": "system",
+            "content": st.session_state.system_prompt,
+        }
 
     st.session_state.model = st.sidebar.selectbox(
         "Model",
-        options=["gpt-4", "gpt-3.5-turbo"],
+        options=["gpt-4o-mini", "gpt-4o", "gpt-4-turbo"],
         index=0,
-        help="Pilih model bahasa. gpt-4 menghasilkan kualitas yang lebih baik."
+        help="Pilih model bahasa. gpt-4o menghasilkan kualitas yang lebih baik; "
+             "keluarga gpt-4o mendukung prompt caching otomatis (lebih cepat dan hemat)."
     )
 
     st.session_state.temperature = st.sidebar.slider(
@@ -133,7 +454,9 @@ def sidebar_controls():
     st.sidebar.markdown("---")
     if st.sidebar.button("Mulai Percakapan Baru"):
         clear_conversation()
-        st.sidebar.success("Percakapan direset.")
+        # This button lives inside the sidebar fragment; without a full
+        # rerun the chat fragment would keep showing the wiped conversation.
+        st.rerun(scope="app")
 
     st.sidebar.markdown("---")
     st.sidebar.caption("Pastikan variabel lingkungan OPENAI_API_KEY telah disetel.")
@@ -156,7 +479,7 @@ def template_builder():
                 prompt = build_prompt_surat_edaran(
                     topik, audiens, str(tanggal), penandatangan, gaya, bilingual
                 )
-                st.session_state.pending_prompt = prompt
+                st.session_state.pending_prompts.append(prompt)
                 st.success("Prompt untuk surat edaran telah disiapkan. Lihat kolom chat di bawah.")
 
     with tab2:
@@ -173,7 +496,7 @@ def template_builder():
             submitted = st.form_submit_button("Susun RKS/RKAS dengan AI")
             if submitted:
                 prompt = build_prompt_rks(periode, fokus, indikator)
-                st.session_state.pending_prompt = prompt
+                st.session_state.pending_prompts.append(prompt)
                 st.success("Prompt untuk RKS/RKAS telah disiapkan. Lihat kolom chat di bawah.")
 
     with tab3:
@@ -186,10 +509,11 @@ def template_builder():
             submitted = st.form_submit_button("Susun dengan AI")
             if submitted:
                 prompt = build_prompt_jadwal(jenis, kondisi)
-                st.session_state.pending_prompt = prompt
+                st.session_state.pending_prompts.append(prompt)
                 st.success("Prompt untuk jadwal/tugas telah disiapkan. Lihat kolom chat di bawah.")
 
 
+@st.cache_data(max_entries=128, show_spinner=False)
 def build_prompt_surat_edaran(
     topik: str,
     audiens: str,
@@ -198,104 +522,186 @@ def build_prompt_surat_edaran(
     gaya: str,
     bilingual: bool,
 ) -> str:
+    # Static instructions lead, user-supplied values trail: the provider's
+    # prefix cache matches token-by-token from the start, so keeping the
+    # boilerplate first lets all surat-edaran prompts share a cached prefix.
     lang_note = "Tulis bilingual (Indonesia dan Inggris) dengan dua bagian terpisah dan konsisten." if bilingual else "Gunakan Bahasa Indonesia yang jelas dan formal."
     return (
-        f"Susun draf Surat Edaran sekolah tentang '{topik}'.\n"
+        "Susun draf Surat Edaran sekolah.\n"
+        "Strukturkan: Kop/Identitas, Nomor, Perihal, Salam pembuka, Isi utama (tujuan, rincian, waktu/tempat jika ada), "
+        "Instruksi/harapan, Penutup, Tanda tangan, Tembusan (jika perlu). "
+        "Sertakan placeholder yang jelas untuk nomor surat, lampiran, dan kontak.\n"
+        "\n"
+        "---\n"
+        "Parameter:\n"
+        f"- Topik: {topik}\n"
         f"- Audiens: {audiens}\n"
         f"- Tanggal: {tanggal}\n"
         f"- Penandatangan: {penandatangan}\n"
         f"- Gaya bahasa: {gaya}\n"
-        f"- {lang_note}\n"
-        f"Strukturkan: Kop/Identitas, Nomor, Perihal, Salam pembuka, Isi utama (tujuan, rincian, waktu/tempat jika ada), "
-        f"Instruksi/harapan, Penutup, Tanda tangan, Tembusan (jika perlu). "
-        f"Sertakan placeholder yang jelas untuk nomor surat, lampiran, dan kontak."
+        f"- {lang_note}"
     )
 
 
+@st.cache_data(max_entries=128, show_spinner=False)
 def build_prompt_rks(periode: str, fokus: str, indikator: str) -> str:
     return (
         "Buat RKS/RKAS ringkas untuk tingkat SMA dengan format tabel/poin yang mudah dipahami.\n"
+        "Cantumkan: tujuan, kegiatan utama, PIC, timeline, kebutuhan sumber daya/anggaran (perkiraan), indikator & cara evaluasi, risiko & mitigasi. "
+        "Gunakan placeholder untuk angka anggaran dan sesuaikan dengan regulasi sekolah.\n"
+        "\n"
+        "---\n"
+        "Parameter:\n"
         f"- Periode: {periode}\n"
         f"- Fokus Program:\n{fokus}\n"
-        f"- Indikator Keberhasilan (opsional):\n{indikator}\n"
-        "Cantumkan: tujuan, kegiatan utama, PIC, timeline, kebutuhan sumber daya/anggaran (perkiraan), indikator & cara evaluasi, risiko & mitigasi. "
-        "Gunakan placeholder untuk angka anggaran dan sesuaikan dengan regulasi sekolah."
+        f"- Indikator Keberhasilan (opsional):\n{indikator}"
     )
 
 
+@st.cache_data(max_entries=128, show_spinner=False)
 def build_prompt_jadwal(jenis: str, kondisi: str) -> str:
     return (
-        f"Susun {jenis.lower()} untuk SMA. "
+        "Susun jadwal atau pembagian tugas untuk SMA. "
         "Berikan langkah penyusunan, asumsi, dan keluaran akhir berupa tabel/poin yang rapi. "
-        f"Pertimbangkan ketentuan berikut (jika relevan):\n{kondisi}\n"
-        "Sertakan catatan tentang cara menyesuaikan jika terjadi konflik jadwal."
+        "Sertakan catatan tentang cara menyesuaikan jika terjadi konflik jadwal.\n"
+        "\n"
+        "---\n"
+        "Parameter:\n"
+        f"- Jenis: {jenis}\n"
+        f"- Ketentuan/Kebijakan (jika relevan):\n{kondisi}"
+    )
+
+
+@st.cache_data(show_spinner=False)
+def build_transcript(msg_tuple: Tuple[Tuple[str, str], ...]) -> str:
+    # Memoized on the message tuple: identical conversations (e.g. the
+    # history-summarization path) reuse the cached string. Single-pass
+    # generator join avoids the intermediate list.
+    return "\n".join(
+        f"{'USER' if role == 'user' else 'ASSISTANT'}:\n{content}\n"
+        for role, content in msg_tuple
     )
 
 
-def render_chat(client: Optional[OpenAI]):
+@st.fragment
+def render_chat(client: Optional["OpenAI"]):
     st.subheader("Asisten AI Kepala Sekolah")
 
-    # Display existing messages
+    # Display existing messages. Streamlit clears and redraws a fragment's
+    # elements on each of its reruns, so the replay must always cover the
+    # full list — any gate that skips it would blank the transcript.
+    # Rerun isolation comes from the st.fragment decorator instead.
     for msg in st.session_state.messages:
         with st.chat_message(msg["role"]):
             st.write(msg["content"])
 
-    # If a template prepared a prompt, show it as a prefill hint
-    if st.session_state.pending_prompt:
+    # If templates prepared prompts, show them as prefill hints
+    pending = list(st.session_state.pending_prompts)
+    if pending:
         with st.expander("Prompt siap digunakan dari Template", expanded=True):
-            st.code(st.session_state.pending_prompt)
-        prefill = st.session_state.pending_prompt
-    else:
-        prefill = ""
+            for prompt in pending:
+                st.code(prompt)
 
     user_input = st.chat_input(
         "Ketik pertanyaan atau perintah Anda di sini...",
     )
 
-    # If user hasn't typed but we have pending prompt, auto-fill on button
-    if prefill and not user_input:
+    # If user hasn't typed but we have pending prompts, submit on button.
+    # A single prompt goes through the normal (streaming) path; several
+    # queued prompts are dispatched concurrently with asyncio.gather so
+    # they cost ~1x single-prompt latency instead of N x.
+    if pending and not user_input:
         if st.button("Gunakan Prompt di atas"):
-            user_input = prefill
-            st.session_state.pending_prompt = ""
+            # Clear before issuing the calls to avoid resubmission on retry
+            st.session_state.pending_prompts = []
+            if len(pending) == 1:
+                user_input = pending[0]
+            else:
+                try:
+                    if client is None:
+                        raise RuntimeError("OpenAI client is not initialized. Set OPENAI_API_KEY.")
+                    base_messages = list(st.session_state.wire_messages)
+
+                    async def gather_replies() -> List[str]:
+                        # gather must be created inside a running loop;
+                        # building it as an argument to asyncio.run fails
+                        # with "no current event loop" on Python 3.10+.
+                        return await asyncio.gather(
+                            *(
+                                ask_openai_async(
+                                    model=str(st.session_state.model),
+                                    messages=base_messages
+                                    + [{"role": "user", "content": prompt}],
+                                    temperature=float(st.session_state.temperature),
+                                    max_tokens=int(st.session_state.max_tokens),
+                                )
+                                for prompt in pending
+                            )
+                        )
+
+                    replies = asyncio.run(gather_replies())
+                    for prompt, reply in zip(pending, replies):
+                        add_message("user", prompt)
+                        add_message("assistant", reply)
+                except Exception as e:
+                    # Restore the queue so the prepared prompts are not lost
+                    st.session_state.pending_prompts = pending
+                    st.error(f"Terjadi kesalahan saat memanggil model: {e}")
+                else:
+                    st.rerun()
+
+    if user_input:
+        # Guard against double-fire (e.g. the "Gunakan Prompt di atas" path
+        # re-submitting on a rerun): if this exact input was the last user
+        # turn and already has an answer, skip the OpenAI call entirely.
+        last_user = next(
+            (m for m in reversed(st.session_state.messages) if m["role"] == "user"),
+            None,
+        )
+        if (
+            last_user is not None
+            and last_user["content"] == user_input
+            and st.session_state.messages[-1]["role"] == "assistant"
+        ):
+            user_input = ""
 
     if user_input:
         add_message("user", user_input)
         with st.chat_message("user"):
             st.write(user_input)
 
-        # Generate assistant response
-        try:
-            if client is None:
-                raise RuntimeError("OpenAI client is not initialized. Set OPENAI_API_KEY.")
-
-            system_prompt = build_system_prompt(st.session_state.language)
-            reply = ask_openai(
-                client=client,
-                model=str(st.session_state.model),
-                system_prompt=system_prompt,
-                history=st.session_state.messages[:-1],  # exclude the just-added user message? No—include full history except system
-                user_input=user_input,
-                temperature=float(st.session_state.temperature),
-                max_tokens=int(st.session_state.max_tokens),
-            )
-            add_message("assistant", reply)
-            with st.chat_message("assistant"):
-                st.write(reply)
-        except Exception as e:
-            error_text = f"Terjadi kesalahan saat memanggil model: {e}"
-            add_message("assistant", error_text)
-            with st.chat_message("assistant"):
+        # Generate assistant response, streaming tokens into the chat bubble
+        tokens: List[str] = []
+        with st.chat_message("assistant"):
+            try:
+                if client is None:
+                    raise RuntimeError("OpenAI client is not initialized. Set OPENAI_API_KEY.")
+
+                def guarded_stream() -> Iterator[str]:
+                    # Accumulate tokens so partial output survives a mid-stream error
+                    for token in ask_openai(
+                        model=str(st.session_state.model),
+                        messages=st.session_state.wire_messages,
+                        temperature=float(st.session_state.temperature),
+                        max_tokens=int(st.session_state.max_tokens),
+                        stream=True,
+                    ):
+                        tokens.append(token)
+                        yield token
+
+                st.write_stream(guarded_stream)
+                add_message("assistant", "".join(tokens))
+            except Exception as e:
+                error_text = f"Terjadi kesalahan saat memanggil model: {e}"
+                partial = "".join(tokens)
+                add_message("assistant", f"{partial}\n\n{error_text}" if partial else error_text)
                 st.error(error_text)
 
     # Utilities: download transcript
     if st.session_state.messages:
-        transcript = []
-        for m in st.session_state.messages:
-            role = "USER" if m["role"] == "user" else "ASSISTANT"
-            transcript.append(f"{role}:\n{m['content']}\n")
         st.download_button(
             "Unduh Transkrip (.txt)",
-            data="\n".join(transcript),
+            data=st.session_state.transcript_bytes,
             file_name="transkrip_asisten_kepsek.txt",
             mime="text/plain",
         )
@@ -317,15 +723,12 @@ def main():
     sidebar_controls()
     template_builder()
 
-    api_key_exists = bool(os.environ.get("OPENAI_API_KEY"))
-    if not api_key_exists:
+    client = get_openai_client()
+    if client is None:
         st.warning(
             "OPENAI_API_KEY belum disetel pada environment. "
             "Set sebelum menggunakan Asisten AI."
         )
-        client = None
-    else:
-        client = get_openai_client()
 
     render_chat(client)
 